@@ -5,7 +5,6 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -15,18 +14,59 @@ from pydantic import BaseModel
 # Load environment variables from .env file
 load_dotenv()
 
+# Connection pool limits, per worker process. Total connections across the deployment can
+# reach workers * MONGO_MAX_POOL_SIZE, so size it against the server's connection limit.
+mongo_max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", 200))
+mongo_min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", 10))
+
+# motor runs every pymongo call on its own module-level thread pool, sized from
+# MOTOR_MAX_WORKERS when motor is first imported (default cpu_count() * 5). In-flight
+# operations per process can't exceed that thread count, so it follows the pool size;
+# a lower explicit MOTOR_MAX_WORKERS caps the usable pool accordingly.
+os.environ.setdefault("MOTOR_MAX_WORKERS", str(mongo_max_pool_size))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
 _client = None
 db = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+def connect_db():
+    """Create the client and its connection pool; call once per worker process at startup"""
+    global _client, db
+    if _client is None and database_url and database_name:
+        _client = AsyncIOMotorClient(
+            database_url,
+            tz_aware=True,
+            maxPoolSize=mongo_max_pool_size,
+            minPoolSize=mongo_min_pool_size,
+            maxIdleTimeMS=300_000,
+            waitQueueTimeoutMS=2000,
+            serverSelectionTimeoutMS=3000,
+            retryWrites=True,
+        )
+        db = _client[database_name]
+    return db
+
+def close_db():
+    """Close the client and release pooled connections"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+def add_timestamps(data_dict: dict) -> dict:
+    """Set created_at/updated_at on a document dict in place and return it"""
+    now = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
+    return data_dict
+
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -37,13 +77,12 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    add_timestamps(data_dict)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +91,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
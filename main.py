@@ -1,33 +1,242 @@
 import os
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import re
+import time
+import itertools
+import contextlib
+import uuid
+import asyncio
+import logging
+import aiofiles
+import aiofiles.os
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from typing import Literal, Optional
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr
-from datetime import datetime, timedelta, timezone
-from database import db, create_document, get_documents
+from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
+from datetime import datetime, timezone
+import database
+from database import add_timestamps, create_document, get_documents
 
-app = FastAPI(title="IMMERZO API")
+try:
+    import blake3
+except ImportError:  # fall back to timestamp + counter upload names
+    blake3 = None
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="IMMERZO API", default_response_class=ORJSONResponse)
+
+# Local storage for uploaded floorplans, served under /uploads
+UPLOAD_DIR = os.path.join("public", "uploads")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+# Allowance for the other multipart form fields on top of the floorplan itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+# Accepted floorplan types and the extension each is stored under; the client's own
+# extension is never used, so a mislabelled .html/.svg can't be served back as such
+UPLOAD_EXTENSIONS = {"application/pdf": ".pdf", "image/png": ".png", "image/jpeg": ".jpg"}
+# Upload disk I/O gets its own threads so slow writes can't starve the shared threadpool
+UPLOAD_IO_THREADS = 32
+_upload_executor: Optional[ThreadPoolExecutor] = None
+_upload_counter = itertools.count()
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def _safe_filename(name: Optional[str]) -> str:
+    # Strip any client-supplied directory parts and restrict to a conservative charset
+    name = _UNSAFE_FILENAME_CHARS.sub("_", os.path.basename(name or ""))[-100:].lstrip(".")
+    return name or "upload"
+
+
+# FastAPI parses the multipart body before the endpoint runs, so oversized uploads are
+# rejected here from Content-Length. Pure ASGI so every other request passes straight through.
+class UploadSizeLimitMiddleware:
+    """Return 413 for POST /api/mall when Content-Length exceeds the upload cap"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/mall":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > MAX_UPLOAD_SIZE + UPLOAD_FORM_OVERHEAD:
+                        response = ORJSONResponse({"detail": "Upload too large"}, status_code=413)
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+# Added before CORS so the 413 still carries CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# Comma-separated list of allowed frontend origins; a wildcard can't be combined with credentials anyway
+ALLOWED_ORIGINS = frozenset(
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "https://immerzo.in,https://www.immerzo.in").split(",")
+    if origin.strip()
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
 )
 
+OTP_TTL_MS = 10 * 60 * 1000
+# verify_otp only needs these (plus _id, which Mongo always returns)
+OTP_VERIFY_PROJECTION = {"code": 1, "expires_at_ms": 1}
+# OTP inserts go straight to Mongo until OTP_DIRECT_INSERT_LIMIT are in flight; beyond that
+# they are coalesced into insert_many batches of up to 500 docs / 50 ms
+OTP_DIRECT_INSERT_LIMIT = 8
+OTP_BATCH_MAX = 500
+OTP_BATCH_WINDOW = 0.05
+OTP_QUEUE_MAX = 5000
+_otp_direct_inserts = 0
+_otp_queue: Optional[asyncio.Queue] = None
+_otp_writer: Optional[asyncio.Task] = None
+
+
+class UploadStaticFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        return response
+
+
+# Serve stored floorplans at the /uploads/{filename} path recorded by submit_mall.
+# The directory is created at startup, hence check_dir=False.
+app.mount("/uploads", UploadStaticFiles(directory=UPLOAD_DIR, check_dir=False), name="uploads")
+
+
+@app.on_event("startup")
+def open_db_pool():
+    # Each worker owns its own pool; clients must not be shared across forks
+    database.connect_db()
+
+
+@app.on_event("startup")
+def ensure_upload_dir():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+
+@app.on_event("startup")
+def start_upload_executor():
+    global _upload_executor
+    _upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_IO_THREADS, thread_name_prefix="upload")
+
+
+@app.on_event("shutdown")
+def stop_upload_executor():
+    global _upload_executor
+    if _upload_executor is not None:
+        _upload_executor.shutdown(wait=True)
+    _upload_executor = None
+
+
+@app.on_event("startup")
+async def ensure_otp_indexes():
+    db = database.db
+    if db is None:
+        return
+    # Latest-OTP lookup in verify_otp, plus TTL purge of expired OTPs.
+    # TTL indexes only work on BSON dates, so purge keys off created_at rather than expires_at_ms.
+    # Don't fail worker startup if MongoDB is unreachable; /test reports the DB error instead
+    try:
+        await db["otprequest"].create_index([("phone", 1), ("purpose", 1), ("created_at_ms", -1)])
+        await db["otprequest"].create_index("created_at", expireAfterSeconds=OTP_TTL_MS // 1000)
+    except Exception:
+        logger.exception("Failed to create otprequest indexes")
+
+
+async def _insert_otp_batch(items: list):
+    # items are (doc, future) pairs; each waiting start_otp learns whether its doc landed
+    try:
+        await database.db["otprequest"].insert_many([doc for doc, _ in items], ordered=False)
+    except Exception as e:
+        logger.exception("Failed to insert %d OTP requests", len(items))
+        for _, fut in items:
+            if not fut.done():
+                fut.set_exception(e)
+    else:
+        for _, fut in items:
+            if not fut.done():
+                fut.set_result(None)
+
+
+async def _otp_batch_writer(queue: asyncio.Queue):
+    # Runs until it receives the None sentinel from stop_otp_writer
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        items = [item]
+        stopping = False
+        deadline = loop.time() + OTP_BATCH_WINDOW
+        while len(items) < OTP_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            items.append(item)
+        await _insert_otp_batch(items)
+        if stopping:
+            return
+
+
+@app.on_event("startup")
+async def start_otp_writer():
+    global _otp_queue, _otp_writer
+    if database.db is None:
+        return
+    _otp_queue = asyncio.Queue(maxsize=OTP_QUEUE_MAX)
+    _otp_writer = asyncio.create_task(_otp_batch_writer(_otp_queue))
+
+
+@app.on_event("shutdown")
+async def stop_otp_writer():
+    global _otp_queue, _otp_writer
+    if _otp_writer is None:
+        return
+    # Let the writer flush whatever is still buffered, then exit
+    await _otp_queue.put(None)
+    await _otp_writer
+    _otp_queue = None
+    _otp_writer = None
+
+
+@app.on_event("shutdown")
+def close_db_pool():
+    database.close_db()
+
 
 # Models (request bodies)
-class OTPStartRequest(BaseModel):
+class RequestModel(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True, str_strip_whitespace=True)
+
+class OTPStartRequest(RequestModel):
     phone: str = Field(..., min_length=10, max_length=15)
-    purpose: str = Field(..., pattern=r"^(franchise|mall)$")
+    purpose: Literal["franchise", "mall"]
 
-class OTPVerifyRequest(BaseModel):
+class OTPVerifyRequest(RequestModel):
     phone: str
-    purpose: str
+    purpose: Literal["franchise", "mall"]
     code: str
 
-class FranchisePayload(BaseModel):
+class FranchisePayload(RequestModel):
     full_name: str
     email: EmailStr
     phone: str
@@ -37,7 +246,7 @@ class FranchisePayload(BaseModel):
     message: Optional[str] = None
     otp_code: Optional[str] = None
 
-class MallPayload(BaseModel):
+class MallPayload(RequestModel):
     contact_name: str
     email: EmailStr
     phone: str
@@ -49,12 +258,30 @@ class MallPayload(BaseModel):
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "IMMERZO Backend Running"}
 
 
+# Env-derived status for /test is fixed for the process lifetime; collection names are
+# cached briefly so liveness probes don't issue a listCollections round trip per hit
+_DB_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+_DB_NAME_STATUS = os.getenv("DATABASE_NAME") or "❌ Not Set"
+COLLECTIONS_CACHE_TTL = 30.0
+_collections_cache: Optional[tuple] = None  # (expires_at monotonic, names)
+
+
+async def _list_collections(db) -> list:
+    global _collections_cache
+    now = time.monotonic()
+    if _collections_cache is not None and now < _collections_cache[0]:
+        return _collections_cache[1]
+    collections = (await db.list_collection_names())[:10]
+    _collections_cache = (now + COLLECTIONS_CACHE_TTL, collections)
+    return collections
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -64,14 +291,14 @@ def test_database():
         "collections": []
     }
 
+    db = database.db
     try:
         if db is not None:
             response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = os.getenv("DATABASE_NAME") or "❌ Not Set"
+            response["database_url"] = _DB_URL_STATUS
+            response["database_name"] = _DB_NAME_STATUS
             try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
+                response["collections"] = await _list_collections(db)
                 response["database"] = "✅ Connected & Working"
                 response["connection_status"] = "Connected"
             except Exception as e:
@@ -86,60 +313,108 @@ def test_database():
 
 # Simple in-DB OTP storage (expires in 10 minutes)
 @app.post("/api/otp/start")
-def start_otp(req: OTPStartRequest):
+async def start_otp(req: OTPStartRequest):
+    global _otp_direct_inserts
     code = "123456"  # Stub code; replace with SMS gateway integration if needed
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
-    create_document("otprequest", {
+    now_ms = int(time.time() * 1000)
+    doc = {
         "phone": req.phone,
         "purpose": req.purpose,
         "code": code,
         "verified": False,
-        "expires_at": expires_at,
-    })
+        "created_at_ms": now_ms,
+        "expires_at_ms": now_ms + OTP_TTL_MS,
+    }
+    if _otp_queue is None or (_otp_queue.empty() and _otp_direct_inserts < OTP_DIRECT_INSERT_LIMIT):
+        _otp_direct_inserts += 1
+        try:
+            await create_document("otprequest", doc)
+        finally:
+            _otp_direct_inserts -= 1
+    else:
+        # Under backlog, join the next insert_many batch and wait for it to land.
+        # Stamp now so the TTL clock starts at request time, not flush time.
+        add_timestamps(doc)
+        done = asyncio.get_running_loop().create_future()
+        await _otp_queue.put((doc, done))
+        await done
     # Return code for demo purposes; in production, do not return code
-    return {"success": True, "message": "OTP sent", "demo_code": code}
+    return ORJSONResponse({"success": True, "message": "OTP sent", "demo_code": code})
+
+
+# OTP failures and the verify success body are serialized once; a fresh Response is built
+# per request since middleware (CORS) appends to a response's headers in place
+_OTP_NOT_FOUND_BODY = orjson.dumps({"detail": "OTP not found"})
+_OTP_INVALID_BODY = orjson.dumps({"detail": "Invalid OTP"})
+_OTP_EXPIRED_BODY = orjson.dumps({"detail": "OTP expired"})
+_SUCCESS_BODY = orjson.dumps({"success": True})
+
+
+class OTPError(Exception):
+    def __init__(self, body: bytes):
+        self.body = body
+
+
+@app.exception_handler(OTPError)
+async def otp_error_handler(request: Request, exc: OTPError):
+    return Response(content=exc.body, status_code=400, media_type="application/json")
+
+
+async def _check_otp(phone: str, purpose: str, code: str) -> None:
+    """Mark the latest OTP for phone/purpose verified, or raise OTPError"""
+    db = database.db
+    rec = None
+    if db is not None:
+        rec = await db["otprequest"].find_one(
+            {"phone": phone, "purpose": purpose},
+            projection=OTP_VERIFY_PROJECTION,
+            sort=[("created_at_ms", -1)],
+        )
+    if rec is None:
+        raise OTPError(_OTP_NOT_FOUND_BODY)
+    if rec.get("code") != code:
+        raise OTPError(_OTP_INVALID_BODY)
+    # A record without expires_at_ms (e.g. written before epoch-ms expiry) counts as expired
+    if time.time() * 1000 > rec.get("expires_at_ms", 0):
+        raise OTPError(_OTP_EXPIRED_BODY)
+    await db["otprequest"].update_one({"_id": rec["_id"]}, {"$set": {"verified": True, "updated_at": datetime.now(timezone.utc)}})
 
 
 @app.post("/api/otp/verify")
-def verify_otp(req: OTPVerifyRequest):
-    recs = list(db["otprequest"].find({"phone": req.phone, "purpose": req.purpose}).sort("created_at", -1).limit(1)) if db else []
-    if not recs:
-        raise HTTPException(status_code=400, detail="OTP not found")
-    rec = recs[0]
-    if rec.get("code") != req.code:
-        raise HTTPException(status_code=400, detail="Invalid OTP")
-    if rec.get("expires_at") and datetime.now(timezone.utc) > rec["expires_at"]:
-        raise HTTPException(status_code=400, detail="OTP expired")
-    db["otprequest"].update_one({"_id": rec["_id"]}, {"$set": {"verified": True, "updated_at": datetime.now(timezone.utc)}})
-    return {"success": True}
+async def verify_otp(req: OTPVerifyRequest):
+    await _check_otp(req.phone, req.purpose, req.code)
+    return Response(content=_SUCCESS_BODY, media_type="application/json")
+
+
+# Static payloads are serialized once at import and served with a shared cache header
+STATIC_CACHE_HEADERS = {"Cache-Control": "public, max-age=300"}
+
+# Populate with real data from Bengaluru unit if available
+_METRICS_BODY = orjson.dumps({
+    "operational_since": "June, 2023",
+    "current_location": "Phoenix Marketcity, Bengaluru",
+    "avg_daily_footfall": 1800,
+    "mom_growth_percent": 18,
+    "avg_tickets_per_day": 240,
+    "peak_days": "Fri-Sun",
+    "corporate_booking_rate_percent": 22,
+    "google_rating": 4.7,
+    "franchise_slots_2025": 3
+})
 
 
 @app.get("/api/metrics")
-def get_metrics():
-    # Populate with real data from Bengaluru unit if available
-    return {
-        "operational_since": "June, 2023",
-        "current_location": "Phoenix Marketcity, Bengaluru",
-        "avg_daily_footfall": 1800,
-        "mom_growth_percent": 18,
-        "avg_tickets_per_day": 240,
-        "peak_days": "Fri-Sun",
-        "corporate_booking_rate_percent": 22,
-        "google_rating": 4.7,
-        "franchise_slots_2025": 3
-    }
+async def get_metrics():
+    return Response(content=_METRICS_BODY, media_type="application/json", headers=STATIC_CACHE_HEADERS)
 
 
 @app.post("/api/franchise")
-def submit_franchise(payload: FranchisePayload):
+async def submit_franchise(payload: FranchisePayload):
     # Optionally verify OTP
     if payload.otp_code:
-        try:
-            verify_otp(OTPVerifyRequest(phone=payload.phone, purpose="franchise", code=payload.otp_code))
-        except HTTPException as e:
-            raise e
-    doc_id = create_document("franchiseinquiry", payload.model_dump())
-    return {"success": True, "id": doc_id}
+        await _check_otp(payload.phone, "franchise", payload.otp_code)
+    doc_id = await create_document("franchiseinquiry", payload.model_dump())
+    return ORJSONResponse({"success": True, "id": doc_id})
 
 
 @app.post("/api/mall")
@@ -154,23 +429,49 @@ async def submit_mall(
     otp_code: Optional[str] = Form(None),
     floorplan: Optional[UploadFile] = File(None),
 ):
+    if floorplan is not None and not floorplan.filename:
+        # Empty file input submitted by the form
+        floorplan = None
+    if floorplan is not None and floorplan.content_type not in UPLOAD_EXTENSIONS:
+        raise HTTPException(status_code=415, detail="Floorplan must be a PDF, PNG or JPEG")
+
     if otp_code:
-        try:
-            verify_otp(OTPVerifyRequest(phone=phone, purpose="mall", code=otp_code))
-        except HTTPException as e:
-            raise e
+        await _check_otp(phone, "mall", otp_code)
 
     file_meta = None
     if floorplan is not None:
-        # Save in local storage under /public/uploads
-        upload_dir = os.path.join("public", "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
-        filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{floorplan.filename}"
-        path = os.path.join(upload_dir, filename)
-        with open(path, "wb") as f:
-            content = await floorplan.read()
-            f.write(content)
-        file_meta = {"filename": filename, "path": f"/uploads/{filename}", "size": len(content)}
+        # Stream to local storage under /public/uploads without buffering the whole file,
+        # hashing as we go so the stored name is content-addressed (identical uploads dedupe)
+        tmp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+        hasher = blake3.blake3() if blake3 is not None else None
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb", executor=_upload_executor) as f:
+                while chunk := await floorplan.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_SIZE:
+                        raise HTTPException(status_code=413, detail="Upload too large")
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await f.write(chunk)
+            ext = UPLOAD_EXTENSIONS[floorplan.content_type]
+            if hasher is not None:
+                filename = hasher.hexdigest()[:32] + ext
+            else:
+                stem = os.path.splitext(_safe_filename(floorplan.filename))[0]
+                filename = f"{int(time.time())}_{os.getpid()}_{next(_upload_counter)}_{stem}{ext}"
+            path = os.path.join(UPLOAD_DIR, filename)
+            if hasher is not None and await aiofiles.os.path.exists(path, executor=_upload_executor):
+                await aiofiles.os.remove(tmp_path, executor=_upload_executor)
+            else:
+                await aiofiles.os.replace(tmp_path, path, executor=_upload_executor)
+        except BaseException:
+            # Never leave a partial file in the publicly served directory. Plain os.remove
+            # so cleanup still runs if the request task is being cancelled.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        file_meta = {"filename": filename, "path": f"/uploads/{filename}", "size": size}
 
     data = {
         "contact_name": contact_name,
@@ -182,21 +483,33 @@ async def submit_mall(
         "message": message,
         "floorplan": file_meta,
     }
-    doc_id = create_document("mallinquiry", data)
-    return {"success": True, "id": doc_id, "file": file_meta}
+    doc_id = await create_document("mallinquiry", data)
+    return ORJSONResponse({"success": True, "id": doc_id, "file": file_meta})
 
 
 # Simple download links and press list
+_RESOURCES_BODY = orjson.dumps({
+    "franchise_kit_url": "/assets/franchise-kit.pdf",
+    "webinar_time": "Saturday 11:00 AM IST",
+    "whatsapp_number": "+91-90XXXXXX00"
+})
+
+
 @app.get("/api/resources")
-def resources():
-    return {
-        "franchise_kit_url": "/assets/franchise-kit.pdf",
-        "webinar_time": "Saturday 11:00 AM IST",
-        "whatsapp_number": "+91-90XXXXXX00"
-    }
+async def resources():
+    return Response(content=_RESOURCES_BODY, media_type="application/json", headers=STATIC_CACHE_HEADERS)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    # Multiple workers require the app as an import string
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )
@@ -13,7 +13,6 @@ Model name is converted to lowercase for the collection name:
 
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional, Literal
-from datetime import datetime
 
 # Existing example schemas (kept for reference)
 class User(BaseModel):
@@ -37,7 +36,8 @@ class OTPRequest(BaseModel):
     code: str = Field(..., min_length=4, max_length=8, description="OTP code")
     purpose: Literal["franchise", "mall"] = Field(..., description="Verification context")
     verified: bool = Field(False)
-    expires_at: datetime
+    created_at_ms: int = Field(..., description="Creation time as epoch milliseconds")
+    expires_at_ms: int = Field(..., description="Expiry time as epoch milliseconds")
 
 class FranchiseInquiry(BaseModel):
     full_name: str = Field(...)